@@ -1,4 +1,20 @@
 """Doc2MD - Document to Markdown converter"""
-from .converter import convert_pdf, convert_docx, convert_html, convert_url
+
+import importlib
+
+__version__ = "0.2.0"
 
 __all__ = ["convert_pdf", "convert_docx", "convert_html", "convert_url"]
+
+# Submodules importing the package used to load, still reachable as attributes
+_SUBMODULES = ("converter", "cache")
+
+
+def __getattr__(name):
+    # Import the converter on first use so `doc2md.mcp_server` and version
+    # lookups don't load the document parsers
+    if name in _SUBMODULES:
+        return importlib.import_module(f".{name}", __name__)
+    if name in __all__:
+        return getattr(importlib.import_module(".converter", __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -2,22 +2,49 @@
 Doc2MD REST API
 """
 
+import asyncio
+import hashlib
 import os
-from typing import Optional
+from contextlib import asynccontextmanager
+from typing import Awaitable, BinaryIO, Callable, Optional
 
 from fastapi import FastAPI, UploadFile, File, HTTPException, Query, Request
 from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel
+from brotli_asgi import BrotliMiddleware
 import uvicorn
 
-from .converter import convert_pdf, convert_docx, convert_html, convert_url
+from . import __version__, cache
+from .converter import (
+    convert_pdf,
+    convert_docx,
+    convert_html,
+    convert_url,
+    close_http_client,
+    enable_pdf_workers,
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Runs in every uvicorn worker, whose main module is safe to re-import
+    enable_pdf_workers()
+    await cache.init_cache()
+    yield
+    await close_http_client()
+    await cache.close_cache()
+
 
 app = FastAPI(
     title="Doc2MD",
     description="Document to Markdown converter API. Supports PDF, Word, HTML, and URLs.",
-    version="0.2.0",
+    version=__version__,
+    lifespan=lifespan,
 )
 
+# Markdown compresses well; falls back to gzip for clients without br
+app.add_middleware(BrotliMiddleware, quality=4, minimum_size=1024, gzip_fallback=True)
+
 
 class UrlRequest(BaseModel):
     url: str
@@ -37,12 +64,49 @@ class ConversionResponse(BaseModel):
     char_count: int
 
 
+def _file_key(kind: str, file: BinaryIO) -> str:
+    """Build a cache key from a file hashed in chunks, and rewind it for the converter."""
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: file.read(1 << 20), b""):
+        digest.update(chunk)
+    file.seek(0)
+    return cache.make_key(kind, digest.hexdigest())
+
+
+async def _cached_convert(make_key: Callable[[], str], convert: Callable[[], Awaitable[str]]) -> str:
+    """
+    Return the cached markdown for the request, converting and storing on a miss.
+    
+    Args:
+        make_key: Builds the cache key; only called when a cache is configured,
+            and run in a thread since it hashes the whole upload
+        convert: Produces the markdown on a cache miss
+    """
+    if not cache.enabled():
+        return await convert()
+    
+    key = await asyncio.to_thread(make_key)
+    markdown = await cache.get_cached(key)
+    if markdown is None:
+        markdown = await convert()
+        await cache.set_cached(key, markdown)
+    return markdown
+
+
+async def _cached_convert_url(url: str, use_fallback: bool, prefer_markdown_new: bool, **kwargs) -> str:
+    """convert_url with the result cached per URL and conversion options."""
+    return await _cached_convert(
+        lambda: cache.make_key("url", url, str(use_fallback), str(prefer_markdown_new)),
+        lambda: convert_url(url, use_fallback=use_fallback, prefer_markdown_new=prefer_markdown_new, **kwargs),
+    )
+
+
 @app.get("/")
 async def root():
     return {
         "name": "Doc2MD",
         "description": "Document to Markdown converter",
-        "version": "0.2.0",
+        "version": __version__,
         "endpoints": {
             "/convert/pdf": "POST - Convert PDF file",
             "/convert/docx": "POST - Convert Word document",
@@ -60,7 +124,7 @@ async def root():
 
 @app.get("/health")
 async def health():
-    return {"status": "ok"}
+    return {"status": "ok", **cache.stats}
 
 
 # ============== URL Prefix Mode ==============
@@ -79,7 +143,7 @@ async def url_prefix_https(
     """
     url = f"https://{path}"
     try:
-        markdown = await convert_url(url, use_fallback=fallback, prefer_markdown_new=prefer_new)
+        markdown = await _cached_convert_url(url, use_fallback=fallback, prefer_markdown_new=prefer_new)
         return markdown
     except Exception as e:
         raise HTTPException(500, f"Conversion failed: {str(e)}")
@@ -97,7 +161,7 @@ async def url_prefix_http(
     """
     url = f"http://{path}"
     try:
-        markdown = await convert_url(url, use_fallback=fallback, prefer_markdown_new=prefer_new)
+        markdown = await _cached_convert_url(url, use_fallback=fallback, prefer_markdown_new=prefer_new)
         return markdown
     except Exception as e:
         raise HTTPException(500, f"Conversion failed: {str(e)}")
@@ -106,7 +170,10 @@ async def url_prefix_http(
 # ============== Standard API Endpoints ==============
 
 @app.post("/convert/pdf", response_model=ConversionResponse)
-async def api_convert_pdf(file: UploadFile = File(...)):
+async def api_convert_pdf(
+    file: UploadFile = File(...),
+    structured: bool = Query(False, description="Keep headings, lists and tables via layout analysis (slower)")
+):
     """Convert PDF to Markdown."""
     if not file.filename or not file.filename.lower().endswith(".pdf"):
         raise HTTPException(400, "File must be a PDF")
@@ -114,7 +181,10 @@ async def api_convert_pdf(file: UploadFile = File(...)):
     content = await file.read()
     
     try:
-        markdown = convert_pdf(content)
+        markdown = await _cached_convert(
+            lambda: cache.make_key("pdf", content, str(structured)),
+            lambda: asyncio.to_thread(convert_pdf, content, structured=structured),
+        )
         return ConversionResponse(
             markdown=markdown,
             source_type="pdf",
@@ -130,10 +200,12 @@ async def api_convert_docx(file: UploadFile = File(...)):
     if not file.filename or not file.filename.lower().endswith((".docx", ".doc")):
         raise HTTPException(400, "File must be a Word document (.docx)")
     
-    content = await file.read()
-    
     try:
-        markdown = convert_docx(content)
+        # Read the spooled upload in place rather than copying it into memory
+        markdown = await _cached_convert(
+            lambda: _file_key("docx", file.file),
+            lambda: asyncio.to_thread(convert_docx, file.file),
+        )
         return ConversionResponse(
             markdown=markdown,
             source_type="docx",
@@ -147,7 +219,10 @@ async def api_convert_docx(file: UploadFile = File(...)):
 async def api_convert_html(request: HtmlRequest):
     """Convert HTML to Markdown."""
     try:
-        markdown = convert_html(request.html, base_url=request.base_url)
+        markdown = await _cached_convert(
+            lambda: cache.make_key("html", request.html, request.base_url or ""),
+            lambda: asyncio.to_thread(convert_html, request.html, base_url=request.base_url),
+        )
         return ConversionResponse(
             markdown=markdown,
             source_type="html",
@@ -161,7 +236,7 @@ async def api_convert_html(request: HtmlRequest):
 async def api_convert_url(request: UrlRequest):
     """Fetch URL and convert to Markdown."""
     try:
-        markdown = await convert_url(
+        markdown = await _cached_convert_url(
             request.url, 
             timeout=request.timeout,
             use_fallback=request.use_fallback,
@@ -184,7 +259,7 @@ async def api_convert_url_get(
 ):
     """Fetch URL and convert to Markdown (GET endpoint for easy testing)."""
     try:
-        markdown = await convert_url(url, use_fallback=fallback, prefer_markdown_new=prefer_new)
+        markdown = await _cached_convert_url(url, use_fallback=fallback, prefer_markdown_new=prefer_new)
         return markdown
     except Exception as e:
         raise HTTPException(500, f"Conversion failed: {str(e)}")
@@ -193,7 +268,17 @@ async def api_convert_url_get(
 def main():
     """Run the API server."""
     port = int(os.environ.get("PORT", 8087))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    workers = int(os.environ.get("WEB_CONCURRENCY", 1))
+    # Multiple workers require an import string so each process can load the app.
+    # "auto" picks uvloop and httptools when installed (uvloop isn't on Windows).
+    uvicorn.run(
+        "doc2md.api:app",
+        host="0.0.0.0",
+        port=port,
+        workers=workers,
+        loop="auto",
+        http="auto",
+    )
 
 
 if __name__ == "__main__":
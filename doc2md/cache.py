@@ -0,0 +1,137 @@
+"""
+Redis-backed conversion cache
+"""
+
+import hashlib
+import os
+from typing import Optional
+
+import redis.asyncio as redis
+
+
+# Default time-to-live for cached conversions, in seconds
+CACHE_TTL = int(os.environ.get("CACHE_TTL", 3600))
+
+# How long URL validators (ETag/Last-Modified) are kept, in seconds. Much
+# longer than CACHE_TTL so an expired result can still be revalidated with a
+# 304 instead of refetched and reconverted
+HTTP_VALIDATOR_TTL = int(os.environ.get("HTTP_VALIDATOR_TTL", 86400))
+
+# Seconds to wait for Redis before treating a call as a miss, so an
+# unreachable server slows conversions by at most this much
+REDIS_TIMEOUT = 0.5
+
+_client: Optional[redis.Redis] = None
+
+stats = {"cache_hit": 0, "cache_miss": 0}
+
+
+async def init_cache(url: Optional[str] = None) -> None:
+    """
+    Connect to Redis.
+
+    Caching stays disabled when neither `url` nor REDIS_URL is set.
+
+    Args:
+        url: Redis connection URL, defaults to the REDIS_URL env var
+    """
+    global _client
+    url = url or os.environ.get("REDIS_URL")
+    if url:
+        _client = redis.from_url(
+            url,
+            socket_connect_timeout=REDIS_TIMEOUT,
+            socket_timeout=REDIS_TIMEOUT,
+        )
+
+
+async def close_cache() -> None:
+    """Close the Redis connection, if any."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def enabled() -> bool:
+    """Whether a cache is configured; callers skip building keys otherwise."""
+    return _client is not None
+
+
+def make_key(kind: str, *parts: str | bytes) -> str:
+    """Build a cache key from a conversion kind and its inputs."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode() if isinstance(part, str) else part)
+        # Separator keeps ("ab", "c") and ("a", "bc") apart
+        digest.update(b"\0")
+    return f"doc2md:{kind}:{digest.hexdigest()}"
+
+
+async def get_cached(key: str) -> Optional[str]:
+    """Return the cached value for `key`, or None on a miss."""
+    if _client is None:
+        return None
+    try:
+        value = await _client.get(key)
+    except redis.RedisError:
+        # A broken cache must never break conversion
+        return None
+    if value is None:
+        stats["cache_miss"] += 1
+        return None
+    stats["cache_hit"] += 1
+    return value.decode()
+
+
+async def set_cached(key: str, value: str, ttl: Optional[int] = None) -> None:
+    """Store `value` under `key` for `ttl` seconds."""
+    if _client is None:
+        return
+    try:
+        await _client.set(key, value, ex=ttl or CACHE_TTL)
+    except redis.RedisError:
+        pass
+
+
+async def get_validators(url: str) -> Optional[dict[str, str]]:
+    """
+    Return the HTTP validators stored for `url`.
+
+    Returns:
+        Dict with "etag", "last_modified" and "markdown", or None
+    """
+    if _client is None:
+        return None
+    try:
+        entry = await _client.hgetall(make_key("http", url))
+    except redis.RedisError:
+        return None
+    if not entry:
+        return None
+    return {k.decode(): v.decode() for k, v in entry.items()}
+
+
+async def set_validators(
+    url: str,
+    etag: Optional[str],
+    last_modified: Optional[str],
+    markdown: str,
+    ttl: Optional[int] = None,
+) -> None:
+    """Store the response validators for `url` with its converted markdown."""
+    if _client is None or not (etag or last_modified):
+        return
+    key = make_key("http", url)
+    try:
+        async with _client.pipeline(transaction=True) as pipe:
+            pipe.delete(key)
+            pipe.hset(key, mapping={
+                "etag": etag or "",
+                "last_modified": last_modified or "",
+                "markdown": markdown,
+            })
+            pipe.expire(key, ttl or HTTP_VALIDATOR_TTL)
+            await pipe.execute()
+    except redis.RedisError:
+        pass
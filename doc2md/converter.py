@@ -2,105 +2,411 @@
 Document conversion functions
 """
 
+import asyncio
 import io
+import multiprocessing
+import os
 import re
-from typing import Optional
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import BinaryIO, Callable, Iterator, Optional
 
-import fitz  # pymupdf
+import pymupdf
 from docx import Document
-from markdownify import markdownify as md
+from docx.oxml.ns import nsmap
+from docx.text.hyperlink import Hyperlink
+from lxml import etree
+from markdownify import MarkdownConverter
 from bs4 import BeautifulSoup
 import httpx
 
+from . import cache
+
 
 # markdown.new as fallback service
 MARKDOWN_NEW_URL = "https://markdown.new"
 
+# Cache lifetimes for markdown.new results and failures, in seconds
+MARKDOWN_NEW_TTL = int(os.environ.get("MARKDOWN_NEW_TTL", 3600))
+MARKDOWN_NEW_FAIL_TTL = 60
+
+_MARKDOWN_NEW_FAILED = "__FAIL__"
+
+# Leading bytes of binary formats, checked before trusting content-type
+# (origins often label PDFs as application/octet-stream)
+_PDF_MAGIC = b"%PDF-"
+_ZIP_MAGIC = b"PK\x03\x04"
+
+# Connection pool limits for the shared HTTP client
+HTTP_LIMITS = httpx.Limits(max_keepalive_connections=100, max_connections=200)
+
+_http_client: Optional[httpx.AsyncClient] = None
+_http_client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+# Text cleanup patterns, compiled once for the per-page hot path
+_RE_WS = re.compile(r"[ \t]+")
+_RE_NL = re.compile(r"\n{3,}")
+_RE_LIST = re.compile(r"\n\s*-\s+")
+# Any whitespace except newline at the end of a line, matching str.rstrip()
+_RE_TRAILING_WS = re.compile(r"[^\S\n]+$", re.MULTILINE)
+
+# Elements whose class names suggest they hold the main page content
+_CONTENT_CLASS_SELECTOR = '[class*="content"], [class*="article"], [class*="post"], [class*="entry"]'
+
+# HTML to Markdown converter, configured once and reused for every page
+_MD_CONVERTER = MarkdownConverter(
+    heading_style="atx",
+    bullets="-",
+    code_language="",
+)
+
+# Markdown prefix for paragraph styles, checked in order against the style name
+_STYLE_PREFIXES = (
+    ("heading 1", "# "),
+    ("heading 2", "## "),
+    ("heading 3", "### "),
+    ("heading 4", "#### "),
+    ("title", "# "),
+    ("list", "- "),
+)
+
+# Direct bold/italic properties on a paragraph's runs, including runs inside
+# hyperlinks; the only formatting format_runs renders
+_RUN_EMPHASIS = etree.XPath(
+    "./w:r/w:rPr/w:b | ./w:r/w:rPr/w:i | ./w:hyperlink/w:r/w:rPr/w:b | ./w:hyperlink/w:r/w:rPr/w:i",
+    namespaces={"w": nsmap["w"]},
+)
+
+# Below this page count, per-page work is cheaper than dispatching to workers
+PDF_PARALLEL_MIN_PAGES = 8
+
+# Most pages a worker extracts per task. Small enough that max_chars stops
+# the remaining work early, large enough to amortise opening the document
+PDF_PAGES_PER_TASK = 16
+
+# Start PDF workers from a clean interpreter rather than forking the server,
+# which may hold locks in other threads and has sockets the children would
+# keep open
+_PDF_MP_CONTEXT = multiprocessing.get_context(
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+
+_pdf_pool: Optional[ProcessPoolExecutor] = None
+_pdf_pool_lock = threading.Lock()
+
+# Off by default: spawned workers re-import the caller's __main__, which an
+# unguarded script can't survive. The server entry points turn it on.
+_pdf_workers_enabled = False
+
+# PyMuPDF prints warnings to stdout, which is the JSON-RPC channel under the
+# MCP server; stderr is safe everywhere
+pymupdf.set_messages(fd=2)
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    Return the shared HTTP client, creating it on first use.
+    
+    Connections are bound to the event loop that opened them, so a new
+    client is created if called from a different loop.
+    """
+    global _http_client, _http_client_loop
+    loop = asyncio.get_running_loop()
+    if _http_client is None or _http_client.is_closed or _http_client_loop is not loop:
+        _http_client = httpx.AsyncClient(
+            timeout=30.0,
+            follow_redirects=True,
+            http2=True,
+            limits=HTTP_LIMITS,
+        )
+        _http_client_loop = loop
+    return _http_client
+
+
+async def close_http_client() -> None:
+    """Close the shared HTTP client, if any."""
+    global _http_client, _http_client_loop
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+        _http_client_loop = None
+
 
-def convert_pdf(content: bytes, extract_images: bool = False) -> str:
+def enable_pdf_workers(enabled: bool = True) -> None:
+    """
+    Let convert_pdf spread large PDFs over a pool of worker processes.
+    
+    Only call this from a process whose main module is import-safe (a
+    console script or an `if __name__ == "__main__"` guarded script).
+    """
+    global _pdf_workers_enabled
+    _pdf_workers_enabled = enabled
+
+
+def _init_pdf_worker() -> None:
+    """Keep a worker's output off the parent's stdout, the MCP protocol stream."""
+    os.dup2(2, 1)
+    pymupdf.set_messages(fd=2)
+
+
+def _get_pdf_pool() -> ProcessPoolExecutor:
+    """Return the shared PDF worker pool, creating it on first use."""
+    global _pdf_pool
+    # Called from to_thread workers, so two conversions may race to create it
+    with _pdf_pool_lock:
+        if _pdf_pool is None:
+            _pdf_pool = ProcessPoolExecutor(
+                max_workers=os.cpu_count(),
+                mp_context=_PDF_MP_CONTEXT,
+                initializer=_init_pdf_worker,
+            )
+        return _pdf_pool
+
+
+def _discard_pdf_pool(pool: ProcessPoolExecutor) -> None:
+    """Drop a broken worker pool so the next conversion starts a fresh one."""
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is pool:
+            _pdf_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _extract_pages(path: str, start: int, stop: int) -> list[tuple[int, str]]:
+    """Extract cleaned text for pages [start, stop) in a worker process."""
+    # MuPDF documents are not shareable, so every worker opens its own
+    doc = pymupdf.open(path, filetype="pdf")
+    try:
+        return [(i, clean_text(doc[i].get_text("text"))) for i in range(start, stop)]
+    finally:
+        doc.close()
+
+
+def _open_pdf(content: bytes | str | os.PathLike) -> pymupdf.Document:
+    """Open a PDF from bytes or a path."""
+    if isinstance(content, (str, os.PathLike)):
+        return pymupdf.open(content, filetype="pdf")
+    return pymupdf.open(stream=content, filetype="pdf")
+
+
+def _extract_pages_parallel(
+    content: bytes | str | os.PathLike,
+    texts: list[str],
+    max_chars: Optional[int],
+) -> bool:
+    """
+    Fill `texts` with each page's cleaned text using the worker pool.
+    
+    Returns:
+        False if the pool broke before any pages came back, so the caller can
+        extract in-process instead
+    """
+    page_count = len(texts)
+    total = 0
+    received = False
+    
+    # Workers read the document from a file rather than each receiving a
+    # pickled copy of the bytes
+    with _pdf_path(content) as path:
+        # Split pages into contiguous ranges, submitted in page order with
+        # at most one per worker in flight, so reaching max_chars stops
+        # the rest from ever being queued
+        workers = min(os.cpu_count() or 1, page_count)
+        step = min(PDF_PAGES_PER_TASK, -(-page_count // workers))
+        starts = iter(range(0, page_count, step))
+        pool = _get_pdf_pool()
+        inflight: deque[Future] = deque()
+        
+        def submit_next() -> None:
+            start = next(starts, None)
+            if start is not None:
+                inflight.append(
+                    pool.submit(_extract_pages, path, start, min(start + step, page_count))
+                )
+        
+        try:
+            for _ in range(workers):
+                submit_next()
+            while inflight:
+                for i, text in inflight.popleft().result():
+                    texts[i] = text
+                    total += len(text)
+                received = True
+                if max_chars is not None and total > max_chars:
+                    # Pages after the limit stay empty and are skipped later
+                    break
+                submit_next()
+        except BrokenProcessPool:
+            # A worker died (MuPDF can crash on malformed files, or the main
+            # module failed to import) and the pool rejects all further work;
+            # replace it so later PDFs still convert
+            _discard_pdf_pool(pool)
+            if received:
+                raise
+            return False
+        finally:
+            # Ranges still running read the temp file removed on leaving
+            # this block, so let them finish; their results are unused
+            for future in inflight:
+                future.cancel()
+            wait(inflight)
+    return True
+
+
+@contextmanager
+def _pdf_path(content: bytes | str | os.PathLike) -> Iterator[str]:
+    """Yield a file path for the PDF, writing bytes to a temp file if needed."""
+    if isinstance(content, (str, os.PathLike)):
+        yield os.fspath(content)
+        return
+    
+    fd, path = tempfile.mkstemp(suffix=".pdf")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        yield path
+    finally:
+        os.unlink(path)
+
+
+def convert_pdf(
+    content: bytes | str | os.PathLike,
+    extract_images: bool = False,
+    structured: bool = False,
+    max_chars: Optional[int] = None,
+) -> str:
     """
     Convert PDF to Markdown.
     
     Args:
-        content: PDF file bytes
+        content: PDF file bytes, or a path to the PDF file
         extract_images: Whether to extract and embed images (base64)
+        structured: Use pymupdf4llm layout analysis to keep headings, lists
+            and tables (slower, runs in a single process)
+        max_chars: Stop extracting pages once the text exceeds this many
+            characters; callers truncate the (slightly longer) result
     
     Returns:
         Markdown text
     """
-    doc = fitz.open(stream=content, filetype="pdf")
-    markdown_parts = []
+    doc = _open_pdf(content)
     
-    for page_num, page in enumerate(doc, 1):
-        # Extract text blocks
-        text = page.get_text("text")
+    if structured:
+        import pymupdf4llm  # only needed for structured output
         
-        if text.strip():
+        try:
+            markdown = pymupdf4llm.to_markdown(doc, page_chunks=False, write_images=False)
+        finally:
+            doc.close()
+        return post_process_markdown(markdown)
+    
+    page_count = doc.page_count
+    
+    # One slot per page, filled by index so worker results need no sorting
+    texts = [""] * page_count
+    
+    if _pdf_workers_enabled and page_count >= PDF_PARALLEL_MIN_PAGES:
+        doc.close()
+        if _extract_pages_parallel(content, texts, max_chars):
+            doc = None
+        else:
+            # The pool broke before returning any pages; convert here instead
+            doc = _open_pdf(content)
+    
+    if doc is not None:
+        total = 0
+        for i, page in enumerate(doc):
+            texts[i] = clean_text(page.get_text("text"))
+            total += len(texts[i])
+            if max_chars is not None and total > max_chars:
+                break
+        doc.close()
+    
+    markdown_parts = []
+    for page_num, text in enumerate(texts, 1):
+        if text:
             # Add page separator for multi-page docs
             if page_num > 1:
                 markdown_parts.append(f"\n---\n*Page {page_num}*\n")
-            
-            # Clean up text
-            text = clean_text(text)
             markdown_parts.append(text)
     
-    doc.close()
-    
     result = "\n\n".join(markdown_parts)
     return post_process_markdown(result)
 
 
-def convert_docx(content: bytes) -> str:
+@lru_cache(maxsize=256)
+def _style_prefix(style_name: str) -> Optional[str]:
+    """Return the Markdown prefix for a paragraph style, or None for body text."""
+    # Documents reuse a handful of styles, so each name is only matched once
+    style_name = style_name.lower()
+    return next((p for key, p in _STYLE_PREFIXES if key in style_name), None)
+
+
+def convert_docx(content: bytes | str | os.PathLike | BinaryIO, max_chars: Optional[int] = None) -> str:
     """
     Convert Word document to Markdown.
     
     Args:
-        content: DOCX file bytes
+        content: DOCX file bytes, a path, or a seekable binary file object
+        max_chars: Stop converting once the text exceeds this many
+            characters; callers truncate the (slightly longer) result
     
     Returns:
         Markdown text
     """
-    doc = Document(io.BytesIO(content))
+    if isinstance(content, (bytes, bytearray)):
+        content = io.BytesIO(content)
+    elif isinstance(content, os.PathLike):
+        content = os.fspath(content)
+    doc = Document(content)
     markdown_parts = []
+    total = 0
     
     for para in doc.paragraphs:
         text = para.text.strip()
         if not text:
             continue
         
-        style_name = para.style.name.lower() if para.style else ""
-        
-        # Handle headings
-        if "heading 1" in style_name:
-            markdown_parts.append(f"# {text}")
-        elif "heading 2" in style_name:
-            markdown_parts.append(f"## {text}")
-        elif "heading 3" in style_name:
-            markdown_parts.append(f"### {text}")
-        elif "heading 4" in style_name:
-            markdown_parts.append(f"#### {text}")
-        elif "title" in style_name:
-            markdown_parts.append(f"# {text}")
-        elif "list" in style_name:
-            markdown_parts.append(f"- {text}")
-        else:
+        # Handle headings and lists
+        prefix = _style_prefix(para.style.name if para.style else "")
+        if prefix is not None:
+            markdown_parts.append(prefix + text)
+        elif _RUN_EMPHASIS(para._p):
             # Check for bold/italic runs
-            formatted_text = format_runs(para.runs)
+            formatted_text = format_runs(para.iter_inner_content())
             markdown_parts.append(formatted_text)
+        else:
+            # Plain paragraph, no need to build a Run object per run
+            markdown_parts.append(text)
+        
+        total += len(markdown_parts[-1])
+        if max_chars is not None and total > max_chars:
+            break
     
     # Handle tables
     for table in doc.tables:
+        if max_chars is not None and total > max_chars:
+            break
         table_md = convert_table(table)
         markdown_parts.append(table_md)
+        total += len(table_md)
     
     result = "\n\n".join(markdown_parts)
     return post_process_markdown(result)
 
 
 def format_runs(runs) -> str:
-    """Format Word runs with bold/italic."""
+    """Format Word runs with bold/italic; hyperlinks contribute their runs' text."""
     parts = []
     for run in runs:
+        if isinstance(run, Hyperlink):
+            parts.append(format_runs(run.runs))
+            continue
         text = run.text
         if not text:
             continue
@@ -122,7 +428,7 @@ def convert_table(table) -> str:
         rows.append("| " + " | ".join(cells) + " |")
         if i == 0:
             # Add header separator
-            rows.append("|" + "|".join(["---"] * len(cells)) + "|")
+            rows.append("|" + "---|" * len(cells))
     return "\n".join(rows)
 
 
@@ -138,7 +444,7 @@ def convert_html(content: str, base_url: Optional[str] = None) -> str:
         Markdown text
     """
     # Parse and clean HTML
-    soup = BeautifulSoup(content, "html.parser")
+    soup = BeautifulSoup(content, "lxml")
     
     # Remove script and style elements
     for element in soup(["script", "style", "nav", "footer", "header", "aside"]):
@@ -146,24 +452,40 @@ def convert_html(content: str, base_url: Optional[str] = None) -> str:
     
     # Try to find main content
     main_content = (
-        soup.find("main") or 
-        soup.find("article") or 
-        soup.find(class_=re.compile(r"content|article|post|entry")) or
-        soup.find("body") or
+        soup.select_one("main") or 
+        soup.select_one("article") or 
+        soup.select_one(_CONTENT_CLASS_SELECTOR) or
+        soup.body or
         soup
     )
     
+    # convert_soup only converts the children of the node it is given on
+    # older markdownify releases, which would drop the markup of a selected
+    # <h2>, <a> or <pre>; wrapping makes the match itself a child
+    if main_content is not soup:
+        main_content = main_content.wrap(soup.new_tag("div"))
+    
     # Convert to markdown
-    markdown = md(
-        str(main_content),
-        heading_style="atx",
-        bullets="-",
-        code_language="",
-    )
+    # Walk the already-parsed tree instead of serializing it back to HTML
+    # for markdownify to parse again
+    markdown = _MD_CONVERTER.convert_soup(main_content)
     
     return post_process_markdown(markdown)
 
 
+async def _read_body(resp: httpx.Response) -> bytearray:
+    """Read a streamed response into one growing buffer instead of a list of chunks."""
+    body = bytearray()
+    async for chunk in resp.aiter_bytes():
+        body += chunk
+    return body
+
+
+def _decode_body(resp: httpx.Response, body: bytearray) -> str:
+    """Decode a body read by _read_body using the response charset."""
+    return body.decode(resp.encoding or "utf-8", errors="replace")
+
+
 async def convert_url_via_markdown_new(url: str, timeout: float = 30.0) -> str:
     """
     Convert URL via markdown.new service.
@@ -175,26 +497,41 @@ async def convert_url_via_markdown_new(url: str, timeout: float = 30.0) -> str:
     Returns:
         Markdown text
     """
+    key = cache.make_key("mdnew", url)
+    cached = await cache.get_cached(key)
+    if cached == _MARKDOWN_NEW_FAILED:
+        raise RuntimeError("markdown.new failed recently for this URL")
+    if cached is not None:
+        return cached
+    
     markdown_new_url = f"{MARKDOWN_NEW_URL}/{url}"
-    async with httpx.AsyncClient(timeout=timeout, follow_redirects=True) as client:
-        resp = await client.get(markdown_new_url)
+    try:
+        resp = await get_http_client().get(markdown_new_url, timeout=timeout)
         resp.raise_for_status()
-        
-        text = resp.text
-        # markdown.new returns with metadata header, extract content
-        if "Markdown Content:" in text:
-            # Extract content after "Markdown Content:"
-            parts = text.split("Markdown Content:", 1)
-            if len(parts) > 1:
-                return parts[1].strip()
-        return text
+    except httpx.HTTPError:
+        # Remember the failure briefly so an outage is not hit by every caller
+        await cache.set_cached(key, _MARKDOWN_NEW_FAILED, ttl=MARKDOWN_NEW_FAIL_TTL)
+        raise
+    
+    text = resp.text
+    # markdown.new returns with metadata header, extract content
+    if "Markdown Content:" in text:
+        # Extract content after "Markdown Content:"
+        parts = text.split("Markdown Content:", 1)
+        if len(parts) > 1:
+            text = parts[1].strip()
+    
+    await cache.set_cached(key, text, ttl=MARKDOWN_NEW_TTL)
+    return text
 
 
 async def convert_url(
     url: str, 
     timeout: float = 30.0, 
     use_fallback: bool = True,
-    prefer_markdown_new: bool = False
+    prefer_markdown_new: bool = False,
+    max_chars: Optional[int] = None,
+    on_response: Optional[Callable[[], None]] = None,
 ) -> str:
     """
     Fetch URL and convert to Markdown.
@@ -204,6 +541,10 @@ async def convert_url(
         timeout: Request timeout in seconds
         use_fallback: Whether to fallback to markdown.new on failure
         prefer_markdown_new: Use markdown.new as primary source
+        max_chars: Let PDF/DOCX conversion stop early past this many
+            characters; callers truncate the result
+        on_response: Called once the origin's response headers arrive,
+            i.e. when the network wait is over
     
     Returns:
         Markdown text
@@ -217,24 +558,55 @@ async def convert_url(
     
     # Try local conversion first
     try:
-        async with httpx.AsyncClient(timeout=timeout, follow_redirects=True) as client:
-            # Try to get markdown directly (Cloudflare Markdown for Agents)
-            headers = {"Accept": "text/markdown, text/html", "Accept-Encoding": "identity"}
-            resp = await client.get(url, headers=headers)
+        # Try to get markdown directly (Cloudflare Markdown for Agents)
+        headers = {"Accept": "text/markdown, text/html"}
+        
+        # Revalidate against the last conversion if the origin gave us validators
+        validators = await cache.get_validators(url)
+        if validators:
+            if validators["etag"]:
+                headers["If-None-Match"] = validators["etag"]
+            if validators["last_modified"]:
+                headers["If-Modified-Since"] = validators["last_modified"]
+        
+        async with get_http_client().stream("GET", url, headers=headers, timeout=timeout) as resp:
+            if on_response is not None:
+                on_response()
             
-            content_type = resp.headers.get("content-type", "")
+            if resp.status_code == 304 and validators:
+                return validators["markdown"]
             
-            if "text/markdown" in content_type:
-                # Server returned markdown directly!
-                return resp.text
-            elif "application/pdf" in content_type:
-                return convert_pdf(resp.content)
-            else:
-                # HTML - convert to markdown
-                result = convert_html(resp.text, base_url=url)
-                if result and len(result) > 100:  # Basic quality check
-                    return result
+            content_type = resp.headers.get("content-type", "")
+            body = await _read_body(resp)
+        
+        # Only PDF/DOCX honour max_chars, so only they can return a partial result
+        complete = True
+        if "text/markdown" in content_type:
+            # Server returned markdown directly!
+            result = _decode_body(resp, body)
+        elif body.startswith(_PDF_MAGIC) or "application/pdf" in content_type:
+            # Parsing is CPU-bound, keep it off the event loop
+            result = await asyncio.to_thread(convert_pdf, body, max_chars=max_chars)
+            complete = max_chars is None
+        elif body.startswith(_ZIP_MAGIC):
+            # DOCX is a ZIP container; other ZIPs fail here and fall back
+            result = await asyncio.to_thread(convert_docx, body, max_chars=max_chars)
+            complete = max_chars is None
+        else:
+            # HTML - convert to markdown
+            result = await asyncio.to_thread(convert_html, _decode_body(resp, body), base_url=url)
+            if not result or len(result) <= 100:  # Basic quality check
                 raise ValueError("Conversion result too short")
+        
+        # A partial result must never be served later on a 304
+        if complete:
+            await cache.set_validators(
+                url,
+                resp.headers.get("etag"),
+                resp.headers.get("last-modified"),
+                result,
+            )
+        return result
     except Exception as e:
         if use_fallback:
             # Fallback to markdown.new
@@ -248,18 +620,18 @@ async def convert_url(
 def clean_text(text: str) -> str:
     """Clean up extracted text."""
     # Normalize whitespace
-    text = re.sub(r"[ \t]+", " ", text)
+    text = _RE_WS.sub(" ", text)
     # Remove excessive newlines
-    text = re.sub(r"\n{3,}", "\n\n", text)
+    text = _RE_NL.sub("\n\n", text)
     return text.strip()
 
 
 def post_process_markdown(text: str) -> str:
     """Post-process markdown for cleanup."""
     # Remove excessive blank lines
-    text = re.sub(r"\n{3,}", "\n\n", text)
+    text = _RE_NL.sub("\n\n", text)
     # Clean up list formatting
-    text = re.sub(r"\n\s*-\s+", "\n- ", text)
+    text = _RE_LIST.sub("\n- ", text)
     # Remove trailing whitespace
-    text = "\n".join(line.rstrip() for line in text.split("\n"))
+    text = _RE_TRAILING_WS.sub("", text)
     return text.strip()
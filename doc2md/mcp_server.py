@@ -4,175 +4,368 @@ Let AI agents convert documents to Markdown
 """
 
 import asyncio
-import base64
+import os
+import sys
+from pathlib import Path
+from typing import Awaitable, Callable
 
+import pybase64
 from mcp.server import Server
 from mcp.server.stdio import stdio_server
 from mcp.types import Tool, TextContent
 
-from .converter import convert_pdf, convert_docx, convert_html, convert_url, convert_url_via_markdown_new
+# The converter (PyMuPDF, python-docx, lxml, httpx) is imported inside the
+# handlers, so startup and list_tools don't pay for parsers a deployment
+# never calls
 
 server = Server("doc2md")
 
+# Longest markdown returned to the agent, in characters
+MAX_CHARS = 100_000
 
-@server.list_tools()
-async def list_tools() -> list[Tool]:
-    """List available document conversion tools."""
-    return [
-        Tool(
-            name="convert_url_to_markdown",
-            description="抓取网页并转换为 Markdown 格式。支持 Cloudflare Markdown for Agents 协议，失败时自动 fallback 到 markdown.new。",
-            inputSchema={
-                "type": "object",
-                "properties": {
-                    "url": {
-                        "type": "string",
-                        "description": "要转换的网页 URL"
-                    },
-                    "prefer_markdown_new": {
-                        "type": "boolean",
-                        "description": "是否优先使用 markdown.new 服务（默认 false，本地转换优先）",
-                        "default": False
-                    }
-                },
-                "required": ["url"]
-            }
-        ),
-        Tool(
-            name="fetch_via_markdown_new",
-            description="通过 markdown.new 服务转换任意 URL 为 Markdown。适用于本地转换效果不好的网站。",
-            inputSchema={
-                "type": "object",
-                "properties": {
-                    "url": {
-                        "type": "string",
-                        "description": "要转换的网页 URL"
-                    }
-                },
-                "required": ["url"]
-            }
-        ),
-        Tool(
-            name="convert_html_to_markdown",
-            description="将 HTML 内容转换为 Markdown 格式。自动清理脚本、样式等无关内容。",
-            inputSchema={
-                "type": "object",
-                "properties": {
-                    "html": {
-                        "type": "string",
-                        "description": "要转换的 HTML 内容"
-                    }
+# Largest document accepted as base64, after decoding. Checked against
+# len(b64) * 3 // 4 so oversized input is rejected before allocating.
+MAX_DECODED_BYTES = 50 * 1024 * 1024
+
+# Seconds the local URL conversion runs alone before markdown.new is raced
+HEDGE_DELAY = 3.0
+
+# URL conversions in progress, keyed by tool and arguments
+_INFLIGHT: dict[tuple, asyncio.Future] = {}
+
+# User-facing messages
+_TRUNCATED_NOTE = "\n\n...[内容过长，已截断]..."
+_ERR_NO_URL = "错误：需要提供 URL"
+_ERR_NO_HTML = "错误：需要提供 HTML 内容"
+_ERR_NO_PDF = "错误：需要提供 PDF 文件路径或 base64 编码的 PDF"
+_ERR_NO_DOCX = "错误：需要提供 DOCX 文件路径或 base64 编码的 DOCX"
+_ERR_INVALID_BASE64 = "错误：无效的 base64 编码"
+_ERR_TOO_LARGE = f"错误：文件过大（上限 {MAX_DECODED_BYTES // (1024 * 1024)} MB）"
+_ERR_UNKNOWN_TOOL = "未知工具: {}"
+_ERR_FAILED = "转换失败: {}"
+
+
+def _truncate(markdown: str) -> str:
+    """Cut markdown down to MAX_CHARS, marking that it was truncated."""
+    if len(markdown) > MAX_CHARS:
+        return markdown[:MAX_CHARS] + _TRUNCATED_NOTE
+    return markdown
+
+
+# Tool definitions are static, so build them once at import
+_TOOLS: list[Tool] = [
+    Tool(
+        name="convert_url_to_markdown",
+        description="抓取网页并转换为 Markdown 格式。支持 Cloudflare Markdown for Agents 协议，失败时自动 fallback 到 markdown.new。",
+        inputSchema={
+            "type": "object",
+            "properties": {
+                "url": {
+                    "type": "string",
+                    "description": "要转换的网页 URL"
                 },
-                "required": ["html"]
-            }
-        ),
-        Tool(
-            name="convert_pdf_to_markdown",
-            description="将 PDF 文件转换为 Markdown 格式。输入 base64 编码的 PDF 内容。",
-            inputSchema={
-                "type": "object",
-                "properties": {
-                    "pdf_base64": {
-                        "type": "string",
-                        "description": "Base64 编码的 PDF 文件内容"
-                    }
+                "prefer_markdown_new": {
+                    "type": "boolean",
+                    "description": "是否优先使用 markdown.new 服务（默认 false，本地转换优先）",
+                    "default": False
+                }
+            },
+            "required": ["url"]
+        }
+    ),
+    Tool(
+        name="fetch_via_markdown_new",
+        description="通过 markdown.new 服务转换任意 URL 为 Markdown。适用于本地转换效果不好的网站。",
+        inputSchema={
+            "type": "object",
+            "properties": {
+                "url": {
+                    "type": "string",
+                    "description": "要转换的网页 URL"
+                }
+            },
+            "required": ["url"]
+        }
+    ),
+    Tool(
+        name="convert_html_to_markdown",
+        description="将 HTML 内容转换为 Markdown 格式。自动清理脚本、样式等无关内容。",
+        inputSchema={
+            "type": "object",
+            "properties": {
+                "html": {
+                    "type": "string",
+                    "description": "要转换的 HTML 内容"
+                }
+            },
+            "required": ["html"]
+        }
+    ),
+    Tool(
+        name="convert_pdf_to_markdown",
+        description="将 PDF 文件转换为 Markdown 格式。输入本地文件路径，或 base64 编码的 PDF 内容。",
+        inputSchema={
+            "type": "object",
+            "properties": {
+                "pdf_path": {
+                    "type": "string",
+                    "description": "本地 PDF 文件路径（优先使用，无需 base64 编码）"
                 },
-                "required": ["pdf_base64"]
+                "pdf_base64": {
+                    "type": "string",
+                    "description": "Base64 编码的 PDF 文件内容"
+                }
             }
-        ),
-        Tool(
-            name="convert_docx_to_markdown",
-            description="将 Word 文档转换为 Markdown 格式。输入 base64 编码的 DOCX 内容。",
-            inputSchema={
-                "type": "object",
-                "properties": {
-                    "docx_base64": {
-                        "type": "string",
-                        "description": "Base64 编码的 DOCX 文件内容"
-                    }
+        }
+    ),
+    Tool(
+        name="convert_docx_to_markdown",
+        description="将 Word 文档转换为 Markdown 格式。输入本地文件路径，或 base64 编码的 DOCX 内容。",
+        inputSchema={
+            "type": "object",
+            "properties": {
+                "docx_path": {
+                    "type": "string",
+                    "description": "本地 DOCX 文件路径（优先使用，无需 base64 编码）"
                 },
-                "required": ["docx_base64"]
+                "docx_base64": {
+                    "type": "string",
+                    "description": "Base64 编码的 DOCX 文件内容"
+                }
             }
-        ),
-    ]
+        }
+    ),
+]
 
 
-@server.call_tool()
-async def call_tool(name: str, arguments: dict) -> list[TextContent]:
-    """Execute a document conversion tool."""
+@server.list_tools()
+async def list_tools() -> list[Tool]:
+    """List available document conversion tools."""
+    return _TOOLS
+
+
+async def _coalesce(key: tuple, convert: Callable[[], Awaitable[str]]) -> str:
+    """
+    Run `convert` once for concurrent calls sharing `key`.
+    
+    Agents often fire the same URL several times in parallel; later callers
+    wait on the first call's result instead of fetching again.
+    """
+    task = _INFLIGHT.get(key)
+    if task is None:
+        task = asyncio.ensure_future(convert())
+        _INFLIGHT[key] = task
+        task.add_done_callback(lambda _: _INFLIGHT.pop(key, None))
+    # Shielded so one caller being cancelled doesn't cancel the others
+    return await asyncio.shield(task)
+
+
+async def _convert_url_hedged(url: str) -> str:
+    """
+    Convert a URL locally, racing markdown.new if the origin is slow to answer.
     
+    Only the network wait is hedged: if the origin sends no response headers
+    within HEDGE_DELAY seconds, markdown.new is started and the first to
+    succeed or respond wins. Once the origin has answered, local conversion
+    runs alone, since cancelling it can't stop work already in a thread or
+    worker process. markdown.new is still tried if the local path fails.
+    """
+    from .converter import convert_url, convert_url_via_markdown_new
+    
+    responded = asyncio.Event()
+    local = asyncio.create_task(
+        convert_url(url, use_fallback=False, max_chars=MAX_CHARS, on_response=responded.set)
+    )
+    waiter = asyncio.create_task(responded.wait())
+    fallback = None
     try:
-        if name == "convert_url_to_markdown":
-            url = arguments.get("url", "")
-            if not url:
-                return [TextContent(type="text", text="错误：需要提供 URL")]
-            
-            prefer_new = arguments.get("prefer_markdown_new", False)
-            markdown = await convert_url(url, use_fallback=True, prefer_markdown_new=prefer_new)
-            
-            # Truncate if too long
-            if len(markdown) > 100000:
-                markdown = markdown[:100000] + "\n\n...[内容过长，已截断]..."
-            
-            return [TextContent(type="text", text=markdown)]
-        
-        elif name == "fetch_via_markdown_new":
-            url = arguments.get("url", "")
-            if not url:
-                return [TextContent(type="text", text="错误：需要提供 URL")]
-            
-            markdown = await convert_url_via_markdown_new(url)
-            
-            # Truncate if too long
-            if len(markdown) > 100000:
-                markdown = markdown[:100000] + "\n\n...[内容过长，已截断]..."
-            
-            return [TextContent(type="text", text=markdown)]
+        await asyncio.wait({local, waiter}, timeout=HEDGE_DELAY, return_when=asyncio.FIRST_COMPLETED)
+        if not (local.done() or responded.is_set()):
+            fallback = asyncio.create_task(convert_url_via_markdown_new(url))
+            await asyncio.wait({local, waiter, fallback}, return_when=asyncio.FIRST_COMPLETED)
+            if fallback.done() and fallback.exception() is None:
+                return fallback.result()
+            if responded.is_set() and not fallback.done():
+                # The origin answered first; only the fetch was being raced
+                fallback.cancel()
+                fallback = None
         
-        elif name == "convert_html_to_markdown":
-            html = arguments.get("html", "")
-            if not html:
-                return [TextContent(type="text", text="错误：需要提供 HTML 内容")]
-            
-            markdown = convert_html(html)
-            return [TextContent(type="text", text=markdown)]
-        
-        elif name == "convert_pdf_to_markdown":
-            pdf_b64 = arguments.get("pdf_base64", "")
-            if not pdf_b64:
-                return [TextContent(type="text", text="错误：需要提供 base64 编码的 PDF")]
-            
-            try:
-                pdf_bytes = base64.b64decode(pdf_b64)
-            except Exception:
-                return [TextContent(type="text", text="错误：无效的 base64 编码")]
-            
-            markdown = convert_pdf(pdf_bytes)
-            return [TextContent(type="text", text=markdown)]
-        
-        elif name == "convert_docx_to_markdown":
-            docx_b64 = arguments.get("docx_base64", "")
-            if not docx_b64:
-                return [TextContent(type="text", text="错误：需要提供 base64 编码的 DOCX")]
-            
+        try:
+            return await local
+        except Exception as local_error:
             try:
-                docx_bytes = base64.b64decode(docx_b64)
-            except Exception:
-                return [TextContent(type="text", text="错误：无效的 base64 编码")]
-            
-            markdown = convert_docx(docx_bytes)
-            return [TextContent(type="text", text=markdown)]
+                if fallback is None:
+                    fallback = asyncio.create_task(convert_url_via_markdown_new(url))
+                return await fallback
+            except Exception as fallback_error:
+                raise Exception(
+                    f"Both local and fallback conversion failed: {local_error} / {fallback_error}"
+                )
+    finally:
+        # Cancel whatever is still fetching, or everything if we were cancelled
+        for task in (local, waiter, fallback):
+            if task is not None:
+                task.cancel()
+
+
+async def _convert_url_tool(arguments: dict) -> str:
+    url = arguments.get("url", "")
+    if not url:
+        return _ERR_NO_URL
+    
+    prefer_new = arguments.get("prefer_markdown_new", False)
+    if prefer_new:
+        from .converter import convert_url
         
-        else:
-            return [TextContent(type="text", text=f"未知工具: {name}")]
-            
-    except Exception as e:
-        return [TextContent(type="text", text=f"转换失败: {str(e)}")]
+        return await _coalesce(
+            ("url", url, prefer_new),
+            lambda: convert_url(
+                url, use_fallback=True, prefer_markdown_new=True, max_chars=MAX_CHARS
+            ),
+        )
+    return await _coalesce(("url", url, prefer_new), lambda: _convert_url_hedged(url))
+
+
+async def _fetch_via_markdown_new_tool(arguments: dict) -> str:
+    url = arguments.get("url", "")
+    if not url:
+        return _ERR_NO_URL
+    
+    from .converter import convert_url_via_markdown_new
+    
+    return await _coalesce(("mdnew", url), lambda: convert_url_via_markdown_new(url))
+
+
+async def _convert_html_tool(arguments: dict) -> str:
+    html = arguments.get("html", "")
+    if not html:
+        return _ERR_NO_HTML
+    
+    from .converter import convert_html
+    
+    return await asyncio.to_thread(convert_html, html)
+
+
+async def _convert_pdf_tool(arguments: dict) -> str:
+    pdf_path = arguments.get("pdf_path", "")
+    # Popped so the request no longer holds the base64 text during conversion
+    pdf_b64 = arguments.pop("pdf_base64", "")
+    if pdf_path:
+        # Let the parser read the file itself: no base64 round-trip and no
+        # copy of the whole file on the Python heap
+        pdf_source = Path(pdf_path).expanduser()
+    elif pdf_b64:
+        if len(pdf_b64) * 3 // 4 > MAX_DECODED_BYTES:
+            return _ERR_TOO_LARGE
+        # binascii.Error (a ValueError) for bad characters or padding, plain
+        # ValueError for a str with non-ASCII characters
+        try:
+            pdf_source = pybase64.b64decode_as_bytearray(pdf_b64, validate=True)
+        except ValueError:
+            return _ERR_INVALID_BASE64
+        del pdf_b64
+    else:
+        return _ERR_NO_PDF
+    
+    from .converter import convert_pdf
+    
+    return await asyncio.to_thread(convert_pdf, pdf_source, max_chars=MAX_CHARS)
+
+
+async def _convert_docx_tool(arguments: dict) -> str:
+    docx_path = arguments.get("docx_path", "")
+    docx_b64 = arguments.pop("docx_base64", "")
+    if docx_path:
+        docx_source = Path(docx_path).expanduser()
+    elif docx_b64:
+        if len(docx_b64) * 3 // 4 > MAX_DECODED_BYTES:
+            return _ERR_TOO_LARGE
+        try:
+            docx_source = pybase64.b64decode_as_bytearray(docx_b64, validate=True)
+        except ValueError:
+            return _ERR_INVALID_BASE64
+        del docx_b64
+    else:
+        return _ERR_NO_DOCX
+    
+    from .converter import convert_docx
+    
+    return await asyncio.to_thread(convert_docx, docx_source, max_chars=MAX_CHARS)
+
+
+# Tool name -> handler; each handler returns markdown or an error message
+_HANDLERS: dict[str, Callable[[dict], Awaitable[str]]] = {
+    "convert_url_to_markdown": _convert_url_tool,
+    "fetch_via_markdown_new": _fetch_via_markdown_new_tool,
+    "convert_html_to_markdown": _convert_html_tool,
+    "convert_pdf_to_markdown": _convert_pdf_tool,
+    "convert_docx_to_markdown": _convert_docx_tool,
+}
+
+# Comma-separated tool names to expose; unset or blank exposes every tool.
+# Applied once at import so list_tools and call_tool only ever see the
+# enabled subset.
+_ENABLED_TOOLS = {
+    name.strip() for name in os.environ.get("DOC2MD_ENABLED_TOOLS", "").split(",") if name.strip()
+}
+if _ENABLED_TOOLS:
+    _unknown = _ENABLED_TOOLS - _HANDLERS.keys()
+    if _unknown:
+        # stdout is the protocol stream, so warnings go to stderr
+        print(
+            f"doc2md: ignoring unknown tools in DOC2MD_ENABLED_TOOLS: {', '.join(sorted(_unknown))} "
+            f"(available: {', '.join(_HANDLERS)})",
+            file=sys.stderr,
+        )
+    _TOOLS = [tool for tool in _TOOLS if tool.name in _ENABLED_TOOLS]
+    _HANDLERS = {name: h for name, h in _HANDLERS.items() if name in _ENABLED_TOOLS}
+
+
+@server.call_tool()
+async def call_tool(name: str, arguments: dict) -> list[TextContent]:
+    """Execute a document conversion tool."""
+    handler = _HANDLERS.get(name)
+    if handler is None:
+        text = _ERR_UNKNOWN_TOOL.format(name)
+    else:
+        try:
+            text = _truncate(await handler(arguments))
+        except Exception as e:
+            text = _ERR_FAILED.format(e)
+    # Both fields are known-good, so skip pydantic validation of the model
+    return [TextContent.model_construct(type="text", text=text)]
+
+
+async def serve() -> None:
+    """Serve MCP over stdio until the client disconnects."""
+    from . import cache
+    from .converter import enable_pdf_workers
+    
+    # Imported before the stdio streams open, so nothing printed while the
+    # parsers load can land in the protocol stream
+    enable_pdf_workers()
+    # Lets URL conversions be cached and revalidated when REDIS_URL is set
+    await cache.init_cache()
+    try:
+        async with stdio_server() as (read_stream, write_stream):
+            await server.run(read_stream, write_stream, server.create_initialization_options())
+    finally:
+        # Nothing to close if no tool ever loaded the converter
+        converter = sys.modules.get(f"{__package__}.converter")
+        if converter is not None:
+            await converter.close_http_client()
+        await cache.close_cache()
 
 
 def main():
     """Run the MCP server."""
-    asyncio.run(stdio_server(server))
+    try:
+        import uvloop
+    except ImportError:
+        # Not available on Windows
+        asyncio.run(serve())
+    else:
+        uvloop.run(serve())
 
 
 if __name__ == "__main__":
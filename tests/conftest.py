@@ -0,0 +1,72 @@
+"""
+Shared fixtures: small generated documents
+"""
+
+import io
+
+import pymupdf
+import pytest
+from docx import Document
+from docx.oxml import OxmlElement
+from docx.oxml.ns import qn
+
+HYPERLINK_REL = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/hyperlink"
+
+
+def make_pdf(pages: int) -> bytes:
+    """Build a PDF with a few distinct lines of text on every page."""
+    doc = pymupdf.open()
+    for i in range(pages):
+        page = doc.new_page()
+        page.insert_text((72, 72), f"Page {i} heading\nbody   text for page {i}\n\n\n\nlast line {i}")
+    try:
+        return doc.tobytes()
+    finally:
+        doc.close()
+
+
+def _add_hyperlink(para, text: str, bold: bool = False) -> None:
+    r_id = para.part.relate_to("https://example.com", HYPERLINK_REL, is_external=True)
+    link = OxmlElement("w:hyperlink")
+    link.set(qn("r:id"), r_id)
+    run = OxmlElement("w:r")
+    if bold:
+        props = OxmlElement("w:rPr")
+        props.append(OxmlElement("w:b"))
+        run.append(props)
+    run_text = OxmlElement("w:t")
+    run_text.text = text
+    run.append(run_text)
+    link.append(run)
+    para._p.append(link)
+
+
+@pytest.fixture
+def pdf_40_pages() -> bytes:
+    return make_pdf(40)
+
+
+@pytest.fixture
+def docx_bytes() -> bytes:
+    doc = Document()
+    doc.add_heading("Report", level=1)
+    doc.add_paragraph("Plain body text.")
+    para = doc.add_paragraph()
+    para.add_run("Bold").bold = True
+    para.add_run(" and ")
+    para.add_run("italic").italic = True
+    para = doc.add_paragraph("See ")
+    _add_hyperlink(para, "the docs")
+    para = doc.add_paragraph()
+    para.add_run("Note:").bold = True
+    para.add_run(" see ")
+    _add_hyperlink(para, "the docs")
+    table = doc.add_table(rows=2, cols=2)
+    table.cell(0, 0).text = "Name"
+    table.cell(0, 1).text = "Value"
+    table.cell(1, 0).text = "a|b"
+    table.cell(1, 1).text = "1"
+
+    buf = io.BytesIO()
+    doc.save(buf)
+    return buf.getvalue()
@@ -0,0 +1,126 @@
+"""
+Tests for doc2md.converter
+"""
+
+import importlib
+import io
+import random
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+import doc2md
+from doc2md import converter
+from doc2md.converter import (
+    PDF_PARALLEL_MIN_PAGES,
+    convert_docx,
+    convert_html,
+    convert_pdf,
+    post_process_markdown,
+)
+
+
+@pytest.fixture
+def pdf_workers():
+    converter.enable_pdf_workers()
+    yield
+    converter.enable_pdf_workers(False)
+
+
+def test_single_converter_module():
+    module = importlib.import_module("doc2md.converter")
+    assert module is converter is doc2md.converter
+    assert doc2md.convert_pdf is converter.convert_pdf
+
+
+def test_pdf_parallel_matches_serial(pdf_40_pages, pdf_workers):
+    parallel = convert_pdf(pdf_40_pages)
+    assert converter._pdf_pool is not None
+    converter.enable_pdf_workers(False)
+    serial = convert_pdf(pdf_40_pages)
+
+    assert parallel == serial
+    assert "Page 0 heading" in serial and "last line 39" in serial
+    assert "*Page 40*" in serial
+
+
+def test_pdf_from_path(tmp_path, pdf_40_pages):
+    path = tmp_path / "doc.pdf"
+    path.write_bytes(pdf_40_pages)
+    assert convert_pdf(path) == convert_pdf(pdf_40_pages)
+
+
+@pytest.mark.parametrize("parallel", [False, True])
+def test_pdf_max_chars_stops_early(pdf_40_pages, parallel, request):
+    if parallel:
+        request.getfixturevalue("pdf_workers")
+    full = convert_pdf(pdf_40_pages)
+    partial = convert_pdf(pdf_40_pages, max_chars=200)
+
+    assert 200 < len(partial) < len(full)
+    assert full.startswith(partial)
+
+
+def test_pdf_broken_pool_falls_back_in_process(pdf_40_pages, pdf_workers, monkeypatch):
+    class BrokenPool:
+        def submit(self, *args, **kwargs):
+            raise BrokenProcessPool("worker died")
+
+        def shutdown(self, **kwargs):
+            pass
+
+    monkeypatch.setattr(converter, "_get_pdf_pool", BrokenPool)
+    converter.enable_pdf_workers(False)
+    expected = convert_pdf(pdf_40_pages)
+    converter.enable_pdf_workers()
+
+    assert convert_pdf(pdf_40_pages) == expected
+
+
+def test_pdf_small_documents_stay_serial(pdf_workers, monkeypatch):
+    from conftest import make_pdf
+
+    monkeypatch.setattr(converter, "_get_pdf_pool", lambda: pytest.fail("pool used"))
+    assert "Page 0 heading" in convert_pdf(make_pdf(PDF_PARALLEL_MIN_PAGES - 1))
+
+
+def test_docx(docx_bytes):
+    markdown = convert_docx(docx_bytes)
+
+    assert markdown.startswith("# Report")
+    assert "Plain body text." in markdown
+    assert "**Bold** and *italic*" in markdown
+    assert "| Name | Value |\n|---|---|\n| a\\|b | 1 |" in markdown
+
+
+def test_docx_hyperlink_text_kept_with_and_without_emphasis(docx_bytes):
+    paragraphs = convert_docx(docx_bytes).split("\n\n")
+
+    assert "See the docs" in paragraphs
+    assert "**Note:** see the docs" in paragraphs
+
+
+def test_docx_file_object_and_max_chars(docx_bytes):
+    assert convert_docx(io.BytesIO(docx_bytes)) == convert_docx(docx_bytes)
+    assert convert_docx(docx_bytes, max_chars=5) == "# Report"
+
+
+def test_html_keeps_selected_root_markup():
+    html = '<html><body><nav>menu</nav><h2 class="post-title">Title</h2></body></html>'
+    assert convert_html(html) == "## Title"
+
+
+def _post_process_split_join(text: str) -> str:
+    """post_process_markdown as written before the trailing-space regex."""
+    text = converter._RE_NL.sub("\n\n", text)
+    text = converter._RE_LIST.sub("\n- ", text)
+    text = "\n".join(line.rstrip() for line in text.split("\n"))
+    return text.strip()
+
+
+def test_post_process_matches_split_join():
+    rng = random.Random(0)
+    alphabet = ["a", "b", " ", "\t", "\n", "-", "\r", "\x0b", "\x0c", "\xa0", "　"]
+    for _ in range(2000):
+        text = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 40)))
+        assert post_process_markdown(text) == _post_process_split_join(text)
@@ -0,0 +1,77 @@
+"""
+Tests for the MCP tool handlers
+"""
+
+import asyncio
+import base64
+
+import pytest
+
+from doc2md import mcp_server
+from conftest import make_pdf
+
+
+def call(name: str, arguments: dict) -> str:
+    (content,) = asyncio.run(mcp_server.call_tool(name, arguments))
+    return content.text
+
+
+def test_unknown_tool():
+    assert call("no_such_tool", {}) == mcp_server._ERR_UNKNOWN_TOOL.format("no_such_tool")
+
+
+@pytest.mark.parametrize("tool, arg", [
+    ("convert_pdf_to_markdown", "pdf_base64"),
+    ("convert_docx_to_markdown", "docx_base64"),
+])
+@pytest.mark.parametrize("payload", ["not base64!", "abc", "ééé="])
+def test_invalid_base64(tool, arg, payload):
+    assert call(tool, {arg: payload}) == mcp_server._ERR_INVALID_BASE64
+
+
+@pytest.mark.parametrize("tool, arg", [
+    ("convert_pdf_to_markdown", "pdf_base64"),
+    ("convert_docx_to_markdown", "docx_base64"),
+])
+def test_oversize_base64(tool, arg, monkeypatch):
+    monkeypatch.setattr(mcp_server, "MAX_DECODED_BYTES", 16)
+    assert call(tool, {arg: "A" * 32}) == mcp_server._ERR_TOO_LARGE
+
+
+@pytest.mark.parametrize("tool, error", [
+    ("convert_pdf_to_markdown", mcp_server._ERR_NO_PDF),
+    ("convert_docx_to_markdown", mcp_server._ERR_NO_DOCX),
+    ("convert_html_to_markdown", mcp_server._ERR_NO_HTML),
+    ("convert_url_to_markdown", mcp_server._ERR_NO_URL),
+    ("fetch_via_markdown_new", mcp_server._ERR_NO_URL),
+])
+def test_missing_input(tool, error):
+    assert call(tool, {}) == error
+
+
+def test_pdf_base64_and_path_agree(tmp_path):
+    pdf = make_pdf(3)
+    path = tmp_path / "doc.pdf"
+    path.write_bytes(pdf)
+
+    from_b64 = call("convert_pdf_to_markdown", {"pdf_base64": base64.b64encode(pdf).decode()})
+    from_path = call("convert_pdf_to_markdown", {"pdf_path": str(path)})
+
+    assert from_b64 == from_path
+    assert "Page 2 heading" in from_path
+
+
+def test_conversion_error_is_reported(tmp_path):
+    path = tmp_path / "missing.pdf"
+    assert call("convert_pdf_to_markdown", {"pdf_path": str(path)}).startswith(
+        mcp_server._ERR_FAILED.format("")
+    )
+
+
+def test_long_output_truncated(monkeypatch):
+    monkeypatch.setattr(mcp_server, "MAX_CHARS", 50)
+    html = "<main>" + "<p>" + "word " * 200 + "</p></main>"
+    text = call("convert_html_to_markdown", {"html": html})
+
+    assert text.startswith("word word")
+    assert text.endswith(mcp_server._TRUNCATED_NOTE)